@@ -1,18 +1,42 @@
+"""
+High-Performance Asset Compressor.
+
+JPEG decode speed depends on Pillow being linked against libjpeg-turbo with its
+SIMD (AVX2 Huffman/IDCT) kernels enabled:
+
+    Linux:   apt install libjpeg-turbo8-dev, or build libjpeg-turbo from source with SIMD enabled
+    macOS:   brew install jpeg-turbo
+    Windows: install a Pillow wheel built against libjpeg-turbo
+
+A warning is printed at startup if the active Pillow build lacks libjpeg-turbo.
+"""
 import os
+import re
 import glob
 import time
 import gzip
+import mmap
 import shutil
 import brotli
 import argparse
 import logging
+import subprocess
 import concurrent.futures
+from collections import deque
 import questionary
 import sys
-from PIL import Image
-from moviepy import VideoFileClip
+import numpy as np
+import PIL
+from PIL import Image, features
 from tqdm import tqdm
 
+# libvips streams decode -> resize -> encode without a full raster in Python; Pillow is the fallback
+try:
+    import pyvips
+except (ImportError, OSError):
+    # OSError: pyvips is installed but the libvips shared library is missing
+    pyvips = None
+
 # Rich UI Imports
 from rich.console import Console
 from rich.panel import Panel
@@ -33,8 +57,26 @@ logging.basicConfig(level=logging.ERROR, format='%(levelname)s: %(message)s')
 MAX_WIDTH = 1920
 WEBP_QUALITY = 75
 WEBP_METHOD = 6
+# Images with transparency are encoded lossless; a lower method keeps them from dominating batch time
+WEBP_ALPHA_QUALITY = 90
+WEBP_ALPHA_METHOD = 4
 VIDEO_CRF = 26
-VIDEO_PRESET = 'medium'
+VIDEO_PRESET = 'faster'
+VIDEO_TUNE = 'fastdecode'
+# Videos encoded side by side; each ffmpeg gets an equal share of the cores so x264 never oversubscribes
+VIDEO_CONCURRENCY = 1
+X264_PRESETS = ['ultrafast', 'superfast', 'veryfast', 'faster', 'fast', 'medium', 'slow', 'slower', 'veryslow']
+
+# Supported inputs, tagged with the compressor that handles them
+ASSET_KINDS = {
+    '.png': 'img', '.jpg': 'img', '.jpeg': 'img', '.mp4': 'vid',
+    '.html': 'txt', '.css': 'txt', '.js': 'txt'
+}
+ASSET_EXTS = tuple(ASSET_KINDS)
+
+# libwebp's cwebp encodes with multiple threads (-mt), so run fewer of them side by side
+CWEBP = shutil.which("cwebp")
+IMAGE_WORKERS = max(1, (os.cpu_count() or 1) // 2) if CWEBP and not pyvips else (os.cpu_count() or 1)
 
 # Folders to always ignore to prevent scanning 10k+ dependency files
 IGNORE_DIRS = {
@@ -45,19 +87,39 @@ IGNORE_DIRS = {
 # ==========================================
 # UTILITIES
 # ==========================================
-def get_size_mb(path):
-    if not os.path.exists(path): return 0
-    return os.path.getsize(path) / (1024 * 1024)
-
-def format_size(mb):
-    return f"{mb:.2f} MB"
+def format_size(size_bytes):
+    return f"{size_bytes / (1024 * 1024):.2f} MB"
 
 def benchmark(old_path, new_path):
-    old_size = get_size_mb(old_path)
-    new_size = get_size_mb(new_path)
+    # One stat per path; sizes stay in bytes until they are formatted
+    try:
+        old_size = os.stat(old_path).st_size
+        new_size = os.stat(new_path).st_size
+    except FileNotFoundError:
+        return 0, 0, 0
     ratio = (1 - (new_size / old_size)) * 100 if old_size > 0 else 0
     return old_size, new_size, ratio
 
+def check_jpeg_backend():
+    # Pillow-SIMD reports a version suffixed with ".postN"; confirms the SIMD build is active
+    console.print(f"[dim]Pillow {PIL.__version__}[/dim]")
+    if not features.check_feature('libjpeg_turbo'):
+        console.print("[yellow]Pillow is not built against libjpeg-turbo; JPEG decoding will be slower.[/yellow]")
+    # Record the system libjpeg-turbo build (its version line names the SIMD support) when the tools are installed
+    if shutil.which("cjpeg"):
+        try:
+            out = subprocess.run(["cjpeg", "-version"], capture_output=True, text=True, timeout=5, stdin=subprocess.DEVNULL)
+            console.print(f"[dim]cjpeg: {(out.stderr or out.stdout).strip()}[/dim]")
+        except (OSError, subprocess.SubprocessError):
+            pass
+
+def is_up_to_date(src_path, out_path):
+    # Incremental runs: an output at least as new as its source doesn't need rebuilding
+    try:
+        return os.stat(out_path).st_mtime >= os.stat(src_path).st_mtime
+    except FileNotFoundError:
+        return False
+
 def display_welcome():
     console.clear()
     title = Text("High-Performance Asset Compressor", style="bold cyan")
@@ -109,25 +171,73 @@ def safe_path_input(question):
 # ==========================================
 # CORE LOGIC
 # ==========================================
+def has_alpha(img):
+    return img.mode in ('RGBA', 'LA', 'PA') or 'transparency' in img.info
+
+def webp_with_vips(file_path, new_file_path):
+    img = pyvips.Image.new_from_file(file_path, access='sequential')
+    if img.width > MAX_WIDTH:
+        img = img.resize(MAX_WIDTH / img.width, kernel='lanczos3')
+    if img.hasalpha():
+        img.webpsave(new_file_path, lossless=True, Q=WEBP_ALPHA_QUALITY, effort=WEBP_ALPHA_METHOD)
+    else:
+        img.webpsave(new_file_path, Q=WEBP_QUALITY, effort=WEBP_METHOD)
+
+def webp_with_cwebp(file_path, new_file_path):
+    # Only the header is read here; cwebp does the decode, resize and encode itself
+    with Image.open(file_path) as img:
+        needs_resize = img.width > MAX_WIDTH
+        alpha = has_alpha(img)
+    resize = ["-resize", str(MAX_WIDTH), "0"] if needs_resize else []
+    if alpha: quality = ["-lossless", "-q", str(WEBP_ALPHA_QUALITY), "-m", str(WEBP_ALPHA_METHOD)]
+    else: quality = ["-q", str(WEBP_QUALITY), "-m", str(WEBP_METHOD)]
+    subprocess.run([
+        CWEBP, "-mt", *quality,
+        *resize, file_path, "-o", new_file_path
+    ], check=True, stderr=subprocess.DEVNULL)
+
+def webp_with_pillow(file_path, new_file_path):
+    # The context manager frees the decoder buffers as soon as the save is done
+    with Image.open(file_path) as img:
+        alpha = has_alpha(img)
+        if img.width > MAX_WIDTH:
+            # JPEG only: decode at 1/2, 1/4 or 1/8 scale straight from the DCT coefficients (no-op for other formats)
+            img.draft("RGB", (MAX_WIDTH, int(img.height * MAX_WIDTH / img.width)))
+            img.thumbnail((MAX_WIDTH, 10**9), Image.Resampling.LANCZOS)
+
+        if alpha:
+            img.save(new_file_path, "WEBP", lossless=True, quality=WEBP_ALPHA_QUALITY, method=WEBP_ALPHA_METHOD)
+        else:
+            img.save(new_file_path, "WEBP", quality=WEBP_QUALITY, method=WEBP_METHOD)
+
+def split_asset_path(file_path):
+    # One split per file; outputs are built with f-strings instead of repeated os.path calls
+    dirn, filename = os.path.split(file_path)
+    dot = filename.rfind('.')
+    prefix = f"{dirn}{os.sep}" if dirn else ""
+    return prefix, filename, filename[:dot], filename[dot:].lower()
+
 def compress_image(file_path):
     try:
-        filename = os.path.basename(file_path)
-        name, ext = os.path.splitext(filename)
-        if ext.lower() == '.webp': return None
+        prefix, filename, name, ext = split_asset_path(file_path)
+        if ext == '.webp': return None
 
         new_filename = f"{name}.webp"
-        new_file_path = os.path.join(os.path.dirname(file_path), new_filename)
+        new_file_path = f"{prefix}{new_filename}"
 
-        if os.path.exists(new_file_path):
-             return {"status": "skipped", "reason": "Target exists"}
+        if is_up_to_date(file_path, new_file_path):
+            return {"status": "skipped", "reason": "up-to-date", "original": filename, "new": new_filename}
 
-        img = Image.open(file_path)
-        if img.width > MAX_WIDTH:
-            ratio = MAX_WIDTH / img.width
-            new_height = int(img.height * ratio)
-            img = img.resize((MAX_WIDTH, new_height), Image.Resampling.LANCZOS)
-            
-        img.save(new_file_path, "WEBP", quality=WEBP_QUALITY, method=WEBP_METHOD)
+        # Encode to a temp file and rename, so a failed or interrupted encode never leaves an
+        # output that looks up to date
+        temp_path = f"{prefix}temp_{new_filename}"
+        try:
+            if pyvips: webp_with_vips(file_path, temp_path)
+            elif CWEBP: webp_with_cwebp(file_path, temp_path)
+            else: webp_with_pillow(file_path, temp_path)
+            os.replace(temp_path, new_file_path)
+        finally:
+            if os.path.exists(temp_path): os.remove(temp_path)
         old_size, new_size, ratio = benchmark(file_path, new_file_path)
         return {"status": "success", "original": filename, "new": new_filename, "old_size": old_size, "new_size": new_size, "ratio": ratio}
     except Exception as e:
@@ -135,23 +245,27 @@ def compress_image(file_path):
 
 def compress_video(file_path):
     try:
-        filename = os.path.basename(file_path)
-        name, ext = os.path.splitext(filename)
-        if ext.lower() not in ['.mp4', '.mov', '.avi']: return None
+        prefix, filename, name, ext = split_asset_path(file_path)
+        if ext not in ['.mp4', '.mov', '.avi']: return None
         if "optimized" in name: return None
 
         new_filename = f"{name}.optimized.mp4"
-        new_file_path = os.path.join(os.path.dirname(file_path), new_filename)
-        if os.path.exists(new_file_path): return None
-
-        temp_path = os.path.join(os.path.dirname(file_path), f"temp_{new_filename}")
-        clip = VideoFileClip(file_path)
-        if clip.w > MAX_WIDTH: clip = clip.resized(width=MAX_WIDTH)
-            
-        clip.write_videofile(temp_path, codec="libx264", audio_codec="aac", preset=VIDEO_PRESET, 
-                             ffmpeg_params=["-crf", str(VIDEO_CRF)], logger=None)
-        clip.close()
-        
+        new_file_path = f"{prefix}{new_filename}"
+        if is_up_to_date(file_path, new_file_path):
+            return {"status": "skipped", "reason": "up-to-date", "original": filename, "new": new_filename}
+
+        temp_path = f"{prefix}temp_{new_filename}"
+        threads = max(1, (os.cpu_count() or 1) // VIDEO_CONCURRENCY)
+        # Transcode entirely inside ffmpeg so frames never round-trip through Python
+        subprocess.run([
+            "ffmpeg", "-nostdin", "-y", "-i", file_path,
+            "-vf", f"scale='min({MAX_WIDTH},iw)':-2",
+            "-c:v", "libx264", "-preset", VIDEO_PRESET, "-tune", VIDEO_TUNE, "-crf", str(VIDEO_CRF),
+            "-threads", str(threads), "-x264-params", f"threads={threads}:sliced-threads=0",
+            "-pix_fmt", "yuv420p", "-c:a", "aac", "-movflags", "+faststart",
+            temp_path
+        ], check=True, stdin=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
         if os.path.exists(new_file_path): os.remove(new_file_path)
         os.rename(temp_path, new_file_path)
         old_size, new_size, ratio = benchmark(file_path, new_file_path)
@@ -159,42 +273,177 @@ def compress_video(file_path):
     except Exception as e:
         return {"status": "error", "error": str(e), "file": file_path}
 
+def process_text(file_path):
+    try:
+        filename = os.path.basename(file_path)
+        gz_path, br_path = f"{file_path}.gz", f"{file_path}.br"
+        if is_up_to_date(file_path, gz_path) and is_up_to_date(file_path, br_path):
+            return {"status": "skipped", "reason": "up-to-date"}
+
+        # The source is mapped rather than read, and both compressors take the buffer directly (no bytes copy).
+        # One-shot calls avoid the extra file-object layer of gzip.open; mtime=0 keeps output reproducible
+        def encode(data):
+            return (gzip.compress(data, compresslevel=9, mtime=0),
+                    brotli.compress(data, quality=11, lgwin=22, mode=brotli.MODE_TEXT))
+
+        with open(file_path, 'rb') as f:
+            # Empty files can't be mapped
+            if os.fstat(f.fileno()).st_size == 0:
+                gz_bytes, br_bytes = encode(b"")
+            else:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as data:
+                    gz_bytes, br_bytes = encode(data)
+
+        # Unbuffered writes hand the result straight to the OS
+        with open(gz_path, 'wb', buffering=0) as f_out:
+            f_out.write(gz_bytes)
+        with open(br_path, 'wb', buffering=0) as f_out:
+            f_out.write(br_bytes)
+
+        old_size, new_size, ratio = benchmark(file_path, br_path)
+        return {"status": "success", "original": filename, "new": f"{filename}.br", "old_size": old_size, "new_size": new_size, "ratio": ratio}
+    except Exception as e:
+        return {"status": "error", "error": str(e), "file": file_path}
+
+def update_code_references(text_files, replacements):
+    if not replacements: return 0
+    mapping = {r['original']: r['new'] for r in replacements}
+    # Matching is by filename, not path: a same-named file in another folder or on a CDN URL is rewritten too.
+    # One alternation (longest names first) rewrites each file in a single pass instead of one replace() per asset
+    names = sorted(mapping, key=len, reverse=True)
+    pattern = re.compile(r"(?<![\w.-])(?:" + "|".join(re.escape(n) for n in names) + r")(?![\w.-])")
+
+    updated = 0
+    for path in text_files:
+        try:
+            # newline='' keeps CRLF/LF as-is so only the asset names change
+            with open(path, 'r', encoding='utf-8', newline='') as f:
+                content = f.read()
+            new_content = pattern.sub(lambda m: mapping[m.group(0)], content)
+            if new_content != content:
+                with open(path, 'w', encoding='utf-8', newline='') as f:
+                    f.write(new_content)
+                updated += 1
+        except Exception as e:
+            logging.error(f"Could not update references in {path}: {e}")
+    return updated
+
 # ==========================================
 # FILE SEARCHING
 # ==========================================
+def asset_kind(path):
+    # One lowercase copy and a C-level suffix check; the extension is only sliced out for matches
+    low = path.lower()
+    if low.endswith(ASSET_EXTS): return ASSET_KINDS[low[low.rfind('.'):]]
+    return None
+
 def find_files(start_path):
-    found_files = []
-    extensions = {'.png', '.jpg', '.jpeg', '.mp4'}
-    
-    for root, dirs, files in os.walk(start_path):
-        # In-place modify dirs to skip ignored ones
-        dirs[:] = [d for d in dirs if d not in IGNORE_DIRS]
-        
-        for file in files:
-            ext = os.path.splitext(file)[1].lower()
-            if ext in extensions:
-                found_files.append(os.path.join(root, file))
-    return found_files
+    # Yields as it walks so compression can start before the scan finishes
+    stack = [start_path]
+
+    # DirEntry caches the type from readdir, so no extra stat per entry
+    while stack:
+        path = stack.pop()
+        try:
+            it = os.scandir(path)
+        except NotADirectoryError:
+            # start_path was a single file rather than a folder
+            kind = asset_kind(path)
+            if kind: yield path, kind
+            continue
+        except OSError:
+            # Unreadable folder (e.g. permissions): skip it, as os.walk does
+            continue
+        with it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name not in IGNORE_DIRS:
+                        stack.append(entry.path)
+                # Symlinked files are included (as os.walk did); symlinked folders are not descended
+                elif entry.is_file():
+                    kind = asset_kind(entry.name)
+                    if kind:
+                        yield entry.path, kind
 
 # ==========================================
 # PROCESSOR
 # ==========================================
 def process_batch(files):
     results = []
-    with Progress(SpinnerColumn(), TextColumn("[progress.description]{task.description}"), BarColumn(), TaskProgressColumn(), console=console) as progress:
-        task = progress.add_task(f"[green]Optimizing {len(files)} assets...", total=len(files))
-        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
-            futures = []
-            for f in files:
-                ext = os.path.splitext(f)[1].lower()
-                if ext in ['.png', '.jpg', '.jpeg']: futures.append(executor.submit(compress_image, f))
-                elif ext == '.mp4': futures.append(executor.submit(compress_video, f))
-            
+    videos, texts = [], []
+    # Rendering is throttled: the bar redraws 4x a second and its count is pushed ~200 times per batch
+    with Progress(SpinnerColumn(), TextColumn("[progress.description]{task.description}"), BarColumn(), TaskProgressColumn(), console=console,
+                  refresh_per_second=4, transient=True, auto_refresh=True) as progress:
+        task = progress.add_task("[green]Optimizing assets...", total=None)
+        completed = 0
+        step = 1
+
+        def record(res):
+            nonlocal completed
+            if res: results.append(res)
+            completed += 1
+            if completed % step == 0: progress.update(task, completed=completed)
+
+        def collect(future):
+            record(future.result())
+
+        # Images and text are CPU-bound, so spread them across processes
+        with concurrent.futures.ProcessPoolExecutor(max_workers=IMAGE_WORKERS) as executor:
+            # Submit images while the walk is still running, keeping a bounded number in flight
+            max_in_flight = IMAGE_WORKERS * 2
+            pending = set()
+
+            def wait_for_one():
+                nonlocal pending
+                done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done: collect(future)
+
+            # PNGs (the only inputs that can carry alpha, encoded with the slow lossless path) jump the queue;
+            # JPEGs fill whatever room is left, and at most max_in_flight of them wait for a slot
+            jpegs = deque()
+
+            def top_up():
+                while jpegs and len(pending) < max_in_flight:
+                    pending.add(executor.submit(compress_image, jpegs.popleft()))
+
+            total = 0
+            for f, kind in files:
+                total += 1
+                if kind == 'img':
+                    if f.lower().endswith('.png'):
+                        while len(pending) >= max_in_flight: wait_for_one()
+                        pending.add(executor.submit(compress_image, f))
+                    else:
+                        jpegs.append(f)
+                        if len(jpegs) >= max_in_flight: wait_for_one()
+                        top_up()
+                elif kind == 'vid': videos.append(f)
+                elif kind == 'txt': texts.append(f)
+            step = max(1, total // 200)
+            progress.update(task, total=total, description=f"[green]Optimizing {total} assets...")
+
+            while jpegs:
+                if len(pending) >= max_in_flight: wait_for_one()
+                top_up()
+
+            for future in concurrent.futures.as_completed(pending):
+                collect(future)
+
+            # ffmpeg already uses every core, so videos run one at a time (VIDEO_CONCURRENCY)
+            for f in videos:
+                record(compress_video(f))
+
+            # Point source files at the new assets before their .br/.gz copies are generated.
+            # Up-to-date assets count too, so files added (or missed by an interrupted run) still get rewritten
+            updated = update_code_references(texts, [r for r in results if r['status'] in ('success', 'skipped') and 'new' in r])
+
+            futures = [executor.submit(process_text, f) for f in texts]
             for future in concurrent.futures.as_completed(futures):
-                res = future.result()
-                if res: results.append(res)
-                progress.advance(task)
+                collect(future)
+            progress.update(task, completed=completed)
 
+    if updated:
+        console.print(f"[cyan]Updated asset references in {updated} file(s).[/cyan]")
     console.print("\n")
     table = Table(title="Optimization Report", border_style="cyan")
     table.add_column("File", style="white")
@@ -202,13 +451,16 @@ def process_batch(files):
     table.add_column("New Size", justify="right", style="green")
     table.add_column("Reduction", justify="right", style="bold cyan")
 
-    total_saved = 0
-    count = 0
-    for res in sorted([r for r in results if r['status'] == 'success'], key=lambda x: x.get('ratio', 0), reverse=True):
-        table.add_row(res['original'], format_size(res['old_size']), format_size(res['new_size']), f"{res['ratio']:.1f}%")
-        total_saved += (res['old_size'] - res['new_size'])
-        count += 1
-    
+    # Sizes go into flat arrays so the sort and totals run in C rather than over dicts
+    succ = [r for r in results if r['status'] == 'success']
+    old = np.fromiter((r['old_size'] for r in succ), dtype=np.float64, count=len(succ))
+    new = np.fromiter((r['new_size'] for r in succ), dtype=np.float64, count=len(succ))
+    ratio = (1 - np.divide(new, old, out=np.ones_like(old), where=old > 0)) * 100
+    total_saved = (old - new).sum()
+    count = len(succ)
+    for i in np.argsort(ratio, kind='stable')[::-1]:
+        table.add_row(succ[i]['original'], format_size(old[i]), format_size(new[i]), f"{ratio[i]:.1f}%")
+
     if count > 0:
         console.print(table)
         console.print(f"\n[bold green]Total Space Saved: {format_size(total_saved)}[/bold green]")
@@ -219,21 +471,29 @@ def process_batch(files):
 # MAIN
 # ==========================================
 def main():
+    global VIDEO_PRESET, VIDEO_CRF
     parser = argparse.ArgumentParser(description="Asset Compressor")
     parser.add_argument("-i", "--input", help="Path to images/videos")
+    parser.add_argument("--preset", choices=X264_PRESETS, default=VIDEO_PRESET, help="x264 preset for videos (e.g. ultrafast for drafts, medium for production)")
+    parser.add_argument("--crf", type=int, default=VIDEO_CRF, help="x264 CRF for videos (lower is higher quality)")
     args = parser.parse_args()
 
+    # Videos are encoded in this process, so the module settings apply directly
+    VIDEO_PRESET, VIDEO_CRF = args.preset, args.crf
+
     if args.input:
-        files = find_files(args.input) if os.path.isdir(args.input) else [args.input]
-        process_batch(files)
+        check_jpeg_backend()
+        if os.path.exists(args.input): process_batch(find_files(args.input))
+        else: rprint("[red]Invalid path.[/red]")
     else:
         display_welcome()
+        # After the welcome panel, which clears the screen
+        check_jpeg_backend()
         choice = safe_select("Action:", ["1. Optimize Assets", "2. Exit"])
         if choice and "Optimize" in choice:
             path = safe_path_input("Target folder/file:")
             if path and os.path.exists(path):
-                files = find_files(path) if os.path.isdir(path) else [path]
-                process_batch(files)
+                process_batch(find_files(path))
             else:
                 rprint("[red]Invalid path.[/red]")
         rprint("[bold cyan]Goodbye![/bold cyan]")